@@ -0,0 +1,19 @@
+"""Gunicorn configuration. Run with: gunicorn -c gunicorn.conf.py main:app"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = 4
+# Thread workers let blocking FCM/Mongo calls overlap within each process.
+worker_class = "gthread"
+threads = 32
+# Import the app once in the master so one-shot startup work (index
+# creation, malformed-token purge, OAuth token prefetch) doesn't repeat
+# per worker; pymongo reopens its pool in each child after fork.
+preload_app = True
+
+def post_fork(server, worker):
+    # The master's logging QueueListener thread does not survive the fork,
+    # so reinstall logging (own queue, listener thread, and log file) in
+    # each worker.
+    from main import setup_logging
+    setup_logging()
@@ -1,23 +1,88 @@
 import os
-import json
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from flask import Flask, request, Response, stream_with_context
+from pymongo import MongoClient, DeleteMany, WriteConcern
+from pymongo.errors import DuplicateKeyError
+import redis
 from firebase_admin import credentials, initialize_app, messaging
 from flask_cors import CORS
 from datetime import datetime
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, filename='app.log', format='%(asctime)s - %(message)s')
+class JsonLogFormatter(logging.Formatter):
+    """Render each record as one JSON object per line for cheap ingestion."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+# Configure logging. Records go through a queue so a log call is just a
+# queue.put; the listener thread does the formatting and file IO, keeping
+# synchronous disk writes (and the handler lock) off the request and send
+# paths. Set LOG_LEVEL=WARNING in production to skip INFO lines entirely.
+log_listener = None
+log_queue_handler = None
+logging_pid = None
+
+def setup_logging():
+    """Install queue-based logging for the current process.
+
+    The QueueListener is a thread, and threads do not survive fork(): a
+    worker forked from a preloaded master inherits the queue with no
+    consumer and would silently drop every record. This must therefore run
+    once per process (the gunicorn post_fork hook calls it). Forked
+    processes also get their own log file, because RotatingFileHandler
+    rotation is not safe across processes sharing one file.
+    """
+    global log_listener, log_queue_handler, logging_pid
+    pid = os.getpid()
+    if pid == logging_pid:
+        return
+    filename = "app.log" if logging_pid is None else f"app.{pid}.log"
+    logging_pid = pid
+    log_queue = queue.SimpleQueue()
+    file_handler = RotatingFileHandler(filename, maxBytes=10 * 1024 * 1024, backupCount=3)
+    file_handler.setFormatter(JsonLogFormatter())
+    log_listener = QueueListener(log_queue, file_handler)
+    log_listener.start()
+    root = logging.getLogger()
+    if log_queue_handler is not None:
+        # Inherited from the parent; it feeds a queue nothing consumes here.
+        root.removeHandler(log_queue_handler)
+    log_queue_handler = QueueHandler(log_queue)
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    root.addHandler(log_queue_handler)
+
+setup_logging()
 
 # Firebase Admin SDK initialization
 firebase_admin_sdk_json = os.environ.get("FIREBASE_ADMIN_SDK_JSON")
 if firebase_admin_sdk_json:
     try:
-        cred_dict = json.loads(firebase_admin_sdk_json)
+        cred_dict = orjson.loads(firebase_admin_sdk_json)
         cred = credentials.Certificate(cred_dict)
         initialize_app(cred)
         logging.info("Firebase Admin SDK initialized successfully.")
+        try:
+            # Prefetch the OAuth2 access token so the first fan-out doesn't
+            # pay the oauth2.googleapis.com round trip; google-auth caches
+            # it (~1h) and the SDK's shared session reuses it until expiry.
+            cred.get_access_token()
+        except Exception as e:
+            logging.warning(f"Could not prefetch Firebase access token: {e}")
     except Exception as e:
         logging.error(f"Error initializing Firebase Admin SDK: {e}")
 else:
@@ -26,21 +91,146 @@ else:
 app = Flask(__name__)
 CORS(app)
 
+def ojsonify(obj, status=200):
+    """JSON response via orjson, which encodes in native code unlike jsonify."""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
+# FCM registration tokens are colon-separated URL-safe base64 segments,
+# typically 150-300 chars. Rejecting junk at registration is far cheaper
+# than letting it waste an FCM slot and a delete on every fan-out.
+# Validated with fullmatch — ^...$ anchors would accept a trailing newline.
+TOKEN_PATTERN = r"[A-Za-z0-9_:-]{100,400}"
+TOKEN_RE = re.compile(TOKEN_PATTERN)
+
+# How many messages to build per send_each call. Also used as the pymongo
+# cursor batch_size so server-side fetches line up with FCM batches and
+# sending is pipelined with the cursor instead of waiting for a full drain.
+SEND_BATCH_SIZE = 500
+
+# Thread pools for the FCM fan-out. The work is network-bound, so chunks are
+# dispatched concurrently. Jobs run on their own small pool so a job waiting
+# on its chunks can never deadlock the pool that executes them.
+send_executor = ThreadPoolExecutor(max_workers=16)
+job_executor = ThreadPoolExecutor(max_workers=4)
+
+# FCM tolerates roughly 1000 concurrent pushes per sender; cap in-flight
+# send_each calls accordingly.
+fcm_semaphore = threading.Semaphore(1000)
+
+# Background send jobs are keyed by job id in a shared store (Redis when
+# configured, otherwise a MongoDB collection): the job runs in one worker
+# while status polls can land on any of them, so the registry cannot be a
+# process-local dict. Entries expire after SEND_JOB_TTL seconds.
+SEND_JOB_TTL = 3600
+SEND_JOB_KEY_PREFIX = "fcm:send-job:"
+
+# Short-TTL read-through cache of the projected token list, so repeated
+# sends or polling of /api/tokens don't re-scan the collection. Writes
+# invalidate lazily; a full in-memory cache without a TTL would not scale.
+TOKENS_CACHE_TTL = 30
+tokens_cache = {"ts": 0.0, "data": None}
+tokens_cache_lock = threading.Lock()
+
+def invalidate_tokens_cache():
+    with tokens_cache_lock:
+        tokens_cache["ts"] = 0.0
+        tokens_cache["data"] = None
+
+def iter_tokens():
+    """Yield all registered tokens, serving from the cache when it is fresh.
+
+    With Redis configured, tokens stream straight off SSCAN in
+    SEND_BATCH_SIZE hints with no cache layer. On a MongoDB cache miss the
+    cursor is streamed through while the list is rebuilt, so the first
+    reader is not delayed by the cache fill.
+    """
+    if redis_client:
+        yield from redis_client.sscan_iter(TOKENS_SET_KEY, count=SEND_BATCH_SIZE)
+        return
+    with tokens_cache_lock:
+        fresh = time.time() - tokens_cache["ts"] < TOKENS_CACHE_TTL
+        cached = tokens_cache["data"] if fresh else None
+    if cached is not None:
+        yield from cached
+        return
+    tokens = []
+    cursor = tokens_collection.find({}, {"_id": 0, "token": 1}).batch_size(SEND_BATCH_SIZE)
+    for doc in cursor:
+        tokens.append(doc["token"])
+        yield doc["token"]
+    with tokens_cache_lock:
+        tokens_cache["ts"] = time.time()
+        tokens_cache["data"] = tokens
+
 # MongoDB connection
 mongo_uri = os.environ.get("MONGODB_URI")
 if mongo_uri:
     try:
-        client = MongoClient(mongo_uri)
+        # Single module-global client so all workers share one tuned pool.
+        # Unavailable compressors are ignored by pymongo, so zstd/snappy are
+        # used when their libraries are installed and skipped otherwise.
+        client = MongoClient(
+            mongo_uri,
+            maxPoolSize=200,
+            minPoolSize=20,
+            maxIdleTimeMS=60000,
+            serverSelectionTimeoutMS=3000,
+            retryWrites=True,
+            compressors="zstd,snappy"
+        )
         db = client.notifications_db
         tokens_collection = db.tokens
         notifications_history_collection = db.notifications_history
+        send_jobs_collection = db.send_jobs
+        # Unacknowledged handle for the diagnostic history insert — losing
+        # one entry on a crash is acceptable, waiting a Mongo RTT is not.
+        notifications_history_w0 = notifications_history_collection.with_options(
+            write_concern=WriteConcern(w=0)
+        )
         logging.info("MongoDB connected successfully.")
+        try:
+            # Ensure indexes so token upserts/deletes and the history sort
+            # don't fall back to collection scans.
+            tokens_collection.create_index("token", unique=True, background=True)
+            notifications_history_collection.create_index([("timestamp", -1)], background=True)
+            send_jobs_collection.create_index("updated_at", expireAfterSeconds=SEND_JOB_TTL)
+            # One-shot cleanup of tokens registered before shape validation
+            # existed; they could never be delivered to anyway. \z is the
+            # absolute end anchor in the server's PCRE — $ and \Z both
+            # accept a trailing newline there.
+            removed = tokens_collection.delete_many(
+                {"token": {"$not": {"$regex": rf"^{TOKEN_PATTERN}\z"}}}
+            ).deleted_count
+            if removed:
+                logging.info(f"Removed {removed} malformed tokens at startup.")
+        except Exception as e:
+            logging.error(f"Error creating MongoDB indexes: {e}")
     except Exception as e:
         logging.error(f"Error connecting to MongoDB: {e}")
         client = None # Ensure client is None if connection fails
+        notifications_history_w0 = None
 else:
     logging.warning("MONGODB_URI environment variable not set.")
     client = None # Ensure client is None if URI is not set
+    notifications_history_w0 = None
+
+# Optional Redis token registry. The broadcast workload only ever adds
+# tokens, streams them all, and removes a batch — set semantics, not
+# documents — so when REDIS_URL is set the registry lives in a Redis SET
+# and skips the BSON document wrapper and index lookups entirely. MongoDB
+# stays the fallback token store and always holds the history.
+TOKENS_SET_KEY = "fcm:tokens"
+redis_url = os.environ.get("REDIS_URL")
+if redis_url:
+    try:
+        redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+        redis_client.ping()
+        logging.info("Redis connected successfully.")
+    except Exception as e:
+        logging.error(f"Error connecting to Redis: {e}")
+        redis_client = None
+else:
+    redis_client = None
 
 @app.route("/")
 def home():
@@ -48,148 +238,367 @@ def home():
 
 @app.route("/api/register-token", methods=["POST"])
 def register_token():
-    if not client:
-        return jsonify({"message": "Database not connected"}), 500
-    data = request.get_json()
+    if not client and not redis_client:
+        return ojsonify({"message": "Database not connected"}, 500)
+    try:
+        data = orjson.loads(request.data)
+    except orjson.JSONDecodeError:
+        return ojsonify({"message": "Invalid JSON body"}, 400)
     token = data.get("token")
     if not token:
-        return jsonify({"message": "Token is required"}), 400
+        return ojsonify({"message": "Token is required"}, 400)
+    if not isinstance(token, str) or not TOKEN_RE.fullmatch(token):
+        return ojsonify({"message": "Token is not a valid FCM registration token"}, 400)
 
     try:
-        # Use upsert to update if exists, insert if not
-        tokens_collection.update_one(
-            {"token": token},
-            {"$set": {"token": token, "timestamp": datetime.utcnow()}},
-            upsert=True
-        )
-        return jsonify({"message": "Token registered successfully"}), 200
+        if redis_client:
+            # SADD is an O(1) idempotent insert; no index lookup or
+            # duplicate handling needed.
+            redis_client.sadd(TOKENS_SET_KEY, token)
+            return ojsonify({"message": "Token registered successfully"}, 200)
+        # Fast path: most registrations are new tokens, so try a plain insert
+        # first and only fall back to an update when the unique index on
+        # token reports a duplicate.
+        try:
+            tokens_collection.insert_one({"token": token, "timestamp": datetime.utcnow()})
+        except DuplicateKeyError:
+            tokens_collection.update_one(
+                {"token": token},
+                {"$set": {"timestamp": datetime.utcnow()}}
+            )
+        invalidate_tokens_cache()
+        return ojsonify({"message": "Token registered successfully"}, 200)
     except Exception as e:
         logging.error(f"Error registering token: {e}")
-        return jsonify({"message": "Error registering token"}), 500
+        return ojsonify({"message": "Error registering token"}, 500)
+
+def registered_token_count():
+    """Count registered tokens without streaming them: SCARD on the Redis
+    set, or the collection-metadata estimate on MongoDB."""
+    if redis_client:
+        return redis_client.scard(TOKENS_SET_KEY)
+    return tokens_collection.estimated_document_count()
 
 @app.route("/api/tokens")
 def get_tokens():
-    if not client:
-        return jsonify({"message": "Database not connected"}), 500
-    try:
-        tokens = [doc["token"] for doc in tokens_collection.find({}, {"_id": 0, "token": 1})]
-        return jsonify({"count": len(tokens), "tokens": tokens}), 200
-    except Exception as e:
-        logging.error(f"Error retrieving tokens: {e}")
-        return jsonify({"message": "Error retrieving tokens"}), 500
+    if not client and not redis_client:
+        return ojsonify({"message": "Database not connected"}, 500)
+
+    if request.args.get("count_only"):
+        try:
+            return ojsonify({"count": registered_token_count()}, 200)
+        except Exception as e:
+            logging.error(f"Error counting tokens: {e}")
+            return ojsonify({"message": "Error retrieving tokens"}, 500)
+
+    def generate():
+        # Stream the response as the cursor drains so we never hold the full
+        # token list in memory; the count is appended after the array.
+        # Errors must be handled in here — the response status is already
+        # sent once streaming starts, so on failure we log, close the JSON
+        # with an error field, and stop.
+        count = 0
+        yield '{"tokens": ['
+        try:
+            for token in iter_tokens():
+                prefix = ", " if count else ""
+                count += 1
+                yield prefix + orjson.dumps(token).decode()
+        except Exception as e:
+            logging.error(f"Error streaming tokens: {e}")
+            yield f'], "count": {count}, "error": "Token stream aborted"}}'
+            return
+        yield f'], "count": {count}}}'
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 @app.route("/api/db-health")
 def db_health():
     if not client:
-        return jsonify({"status": "MongoDB connection failed", "error": "MONGODB_URI not set or connection failed"}), 500
+        return ojsonify({"status": "MongoDB connection failed", "error": "MONGODB_URI not set or connection failed"}, 500)
     try:
         client.admin.command("ping")
-        return jsonify({"status": "MongoDB connected"}), 200
+        return ojsonify({"status": "MongoDB connected"}, 200)
     except Exception as e:
         logging.error(f"MongoDB health check failed: {e}")
-        return jsonify({"status": "MongoDB connection failed", "error": str(e)}), 500
-
-@app.route("/api/send-notification", methods=["POST"])
-def send_notification():
-    if not client:
-        return jsonify({"message": "Database not connected"}), 500
-    data = request.get_json()
-    title = data.get("title")
-    body = data.get("body")
-    image = data.get("image")
-
-    if not title or not body:
-        return jsonify({"message": "Title and body are required"}), 400
+        return ojsonify({"status": "MongoDB connection failed", "error": str(e)}, 500)
 
-    try:
-        all_tokens = [doc["token"] for doc in tokens_collection.find({}, {"_id": 0, "token": 1})]
-    except Exception as e:
-        logging.error(f"Error retrieving all tokens for sending notification: {e}")
-        return jsonify({"message": "Error retrieving tokens for notification"}), 500
+def send_message_chunk(tokens, notification, webpush):
+    """Build and send one chunk of messages, bounded by the FCM semaphore.
 
-    if not all_tokens:
-        return jsonify({"message": "No tokens registered"}), 404
+    Message construction happens here on the send pool — as a single list
+    comprehension rather than a per-token append loop — so the CPU cost of
+    building and validating messages is spread across workers instead of
+    serializing on the cursor loop.
 
-    # Send messages in batches
+    Returns (success_count, failure_count, invalid_tokens) for the chunk.
+    """
     invalid_tokens = []
     success_count = 0
     failure_count = 0
+    messages = [
+        messaging.Message(notification=notification, token=token, webpush=webpush)
+        for token in tokens
+    ]
+    with fcm_semaphore:
+        try:
+            batch_response = messaging.send_each(messages)
+        except Exception as e:
+            logging.error(f"Error sending chunk: {e}")
+            return 0, len(messages), invalid_tokens
+    for message, response in zip(messages, batch_response.responses):
+        if response.success:
+            success_count += 1
+        else:
+            failure_count += 1
+            if response.exception and response.exception.code in [
+                "UNREGISTERED",
+                "INVALID_ARGUMENT",
+                "SENDER_ID_MISMATCH",
+                "registration-token-not-registered"
+            ]:
+                invalid_tokens.append(message.token)
+    return success_count, failure_count, invalid_tokens
 
-    for i in range(0, len(all_tokens), 500):
-        batch_tokens = all_tokens[i:i+500]
-        messages = []
-        for token in batch_tokens:
-            message = messaging.Message(
-                notification=messaging.Notification(title=title, body=body),
-                token=token,
-                webpush=messaging.WebpushConfig(
-                    notification=messaging.WebpushNotification(image=image) if image else None
-                )
-            )
-            messages.append(message)
+# Cap on the number of tokens per delete operation; keeps each $in document
+# small and lets the server run the unordered ops independently.
+DELETE_CHUNK_SIZE = 1000
+
+def remove_invalid_tokens(invalid_tokens):
+    """Delete invalid tokens, chunking large lists into an unordered bulk_write."""
+    if redis_client:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for i in range(0, len(invalid_tokens), DELETE_CHUNK_SIZE):
+                pipe.srem(TOKENS_SET_KEY, *invalid_tokens[i:i+DELETE_CHUNK_SIZE])
+            pipe.execute()
+        return
+    if len(invalid_tokens) <= DELETE_CHUNK_SIZE:
+        tokens_collection.delete_many({"token": {"$in": invalid_tokens}})
+        return
+    deletes = [
+        DeleteMany({"token": {"$in": invalid_tokens[i:i+DELETE_CHUNK_SIZE]}})
+        for i in range(0, len(invalid_tokens), DELETE_CHUNK_SIZE)
+    ]
+    tokens_collection.bulk_write(deletes, ordered=False)
 
+def load_send_job(job_id):
+    """Fetch a send job's state from the shared store, or None if unknown."""
+    if redis_client:
+        raw = redis_client.get(SEND_JOB_KEY_PREFIX + job_id)
+        return orjson.loads(raw) if raw else None
+    return send_jobs_collection.find_one({"_id": job_id}, {"_id": 0, "updated_at": 0})
+
+def save_send_job(job_id, fields):
+    """Merge fields into a send job's state and refresh its TTL."""
+    if redis_client:
+        state = load_send_job(job_id) or {}
+        state.update(fields)
+        redis_client.set(SEND_JOB_KEY_PREFIX + job_id, orjson.dumps(state), ex=SEND_JOB_TTL)
+        return
+    # The TTL index on updated_at handles expiry on the MongoDB side.
+    send_jobs_collection.update_one(
+        {"_id": job_id},
+        {"$set": dict(fields, updated_at=datetime.utcnow())},
+        upsert=True
+    )
+
+def run_send_job(job_id, title, body, image):
+    """Fan a notification out to all tokens on the send pool and record results.
+
+    Any unexpected failure marks the job "failed" — the future returned by
+    job_executor.submit is discarded, so an exception escaping this
+    function would otherwise be swallowed by the executor and leave the
+    job polling as "in_progress" forever.
+    """
+    try:
+        do_send_job(job_id, title, body, image)
+    except Exception as e:
+        logging.error(f"Send job {job_id} failed: {e}")
         try:
-            batch_response = messaging.send_all(messages)
-            for idx, response in enumerate(batch_response.responses):
-                if response.success:
-                    success_count += 1
-                else:
-                    failure_count += 1
-                    if response.exception and response.exception.code in [
-                        "UNREGISTERED",
-                        "INVALID_ARGUMENT",
-                        "registration-token-not-registered"
-                    ]:
-                        invalid_tokens.append(batch_tokens[idx])
+            save_send_job(job_id, {"status": "failed", "error": str(e)})
         except Exception as e:
-            logging.error(f"Error sending batch: {e}")
-            failure_count += len(batch_tokens) # Assume all in batch failed if exception
+            logging.error(f"Error recording failure of send job {job_id}: {e}")
+
+def do_send_job(job_id, title, body, image):
+    # Stream tokens from the cursor and dispatch each batch the moment it
+    # fills, so sending overlaps with the cursor fetch instead of first
+    # materializing every token in memory.
+    total_tokens = 0
+    batch_tokens = []
+    futures = []
+    # The notification payload is identical for every token, so build the
+    # shared Notification/WebpushConfig once instead of per message.
+    notification = messaging.Notification(title=title, body=body)
+    webpush = messaging.WebpushConfig(
+        notification=messaging.WebpushNotification(image=image)
+    ) if image else None
+    try:
+        for token in iter_tokens():
+            total_tokens += 1
+            batch_tokens.append(token)
+            if len(batch_tokens) >= SEND_BATCH_SIZE:
+                futures.append(send_executor.submit(send_message_chunk, batch_tokens, notification, webpush))
+                batch_tokens = []
+        if batch_tokens:
+            futures.append(send_executor.submit(send_message_chunk, batch_tokens, notification, webpush))
+    except Exception as e:
+        # Remember the abort but still wait for the batches already in
+        # flight, so the partial counts below are accurate.
+        logging.error(f"Error streaming tokens for sending notification: {e}")
+        stream_error = e
+    else:
+        stream_error = None
+
+    invalid_tokens = set()
+    success_count = 0
+    failure_count = 0
+    for future in futures:
+        chunk_success, chunk_failure, chunk_invalid = future.result()
+        success_count += chunk_success
+        failure_count += chunk_failure
+        invalid_tokens.update(chunk_invalid)
 
     if invalid_tokens:
         try:
-            tokens_collection.delete_many({"token": {"$in": invalid_tokens}})
+            # Sorted so the deletes walk the token index in order.
+            remove_invalid_tokens(sorted(invalid_tokens))
+            invalidate_tokens_cache()
             logging.info(f"Removed {len(invalid_tokens)} invalid tokens.")
         except Exception as e:
             logging.error(f"Error removing invalid tokens: {e}")
 
-    # Log notification to history
-    try:
-        notifications_history_collection.insert_one({
-            "title": title,
-            "body": body,
-            "image": image,
-            "timestamp": datetime.utcnow(),
-            "total_tokens": len(all_tokens),
-            "success_count": success_count,
-            "failure_count": failure_count,
-            "invalid_tokens_removed": len(invalid_tokens)
-        })
-        logging.info("Notification logged to history.")
-    except Exception as e:
-        logging.error(f"Error logging notification to history: {e}")
+    # Log notification to history (fire-and-forget); skipped cleanly when
+    # MongoDB is absent, e.g. a Redis-only deployment.
+    if notifications_history_w0 is not None:
+        try:
+            notifications_history_w0.insert_one({
+                "title": title,
+                "body": body,
+                "image": image,
+                "timestamp": datetime.utcnow(),
+                "total_tokens": total_tokens,
+                "success_count": success_count,
+                "failure_count": failure_count,
+                "invalid_tokens_removed": len(invalid_tokens)
+            })
+            logging.info("Notification logged to history.")
+        except Exception as e:
+            logging.error(f"Error logging notification to history: {e}")
 
-    return jsonify({
-        "message": "Notification send process completed",
-        "total_tokens_processed": len(all_tokens),
+    # An aborted token stream means part of the registry was never fetched;
+    # report the partial counts but mark the job failed, not completed.
+    result = {
+        "status": "completed",
+        "total_tokens": total_tokens,
         "success_count": success_count,
         "failure_count": failure_count,
         "invalid_tokens_removed": len(invalid_tokens)
-    }), 200
+    }
+    if stream_error is not None:
+        result["status"] = "failed"
+        result["error"] = f"Token stream aborted after {total_tokens} tokens: {stream_error}"
+    save_send_job(job_id, result)
+
+@app.route("/api/send-notification", methods=["POST"])
+def send_notification():
+    if not client and not redis_client:
+        return ojsonify({"message": "Database not connected"}, 500)
+    try:
+        data = orjson.loads(request.data)
+    except orjson.JSONDecodeError:
+        return ojsonify({"message": "Invalid JSON body"}, 400)
+    title = data.get("title")
+    body = data.get("body")
+    image = data.get("image")
+
+    if not title or not body:
+        return ojsonify({"message": "Title and body are required"}, 400)
+
+    try:
+        if redis_client:
+            if redis_client.scard(TOKENS_SET_KEY) == 0:
+                return ojsonify({"message": "No tokens registered"}, 404)
+        elif tokens_collection.find_one({}, {"_id": 1}) is None:
+            return ojsonify({"message": "No tokens registered"}, 404)
+    except Exception as e:
+        logging.error(f"Error checking for registered tokens: {e}")
+        return ojsonify({"message": "Error retrieving tokens for notification"}, 500)
+
+    # Run the fan-out in the background so the HTTP worker is freed immediately;
+    # clients poll /api/send-status/<job_id> for the result.
+    job_id = str(uuid.uuid4())
+    try:
+        save_send_job(job_id, {
+            "status": "in_progress",
+            "created_at": datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        logging.error(f"Error creating send job: {e}")
+        return ojsonify({"message": "Error starting notification send"}, 500)
+    job_executor.submit(run_send_job, job_id, title, body, image)
+
+    return ojsonify({
+        "message": "Notification send started",
+        "job_id": job_id
+    }, 202)
+
+@app.route("/api/send-status/<job_id>")
+def send_status(job_id):
+    if not client and not redis_client:
+        return ojsonify({"message": "Database not connected"}, 500)
+    try:
+        job = load_send_job(job_id)
+    except Exception as e:
+        logging.error(f"Error loading send job {job_id}: {e}")
+        return ojsonify({"message": "Error retrieving job status"}, 500)
+    if not job:
+        return ojsonify({"message": "Job not found"}, 404)
+    return ojsonify(job, 200)
 
 @app.route("/api/notifications-history")
 def get_notifications_history():
     if not client:
-        return jsonify({"message": "Database not connected"}), 500
+        return ojsonify({"message": "Database not connected"}, 500)
     try:
-        history = []
-        for doc in notifications_history_collection.find({}, {"_id": 0}).sort("timestamp", -1):
-            history.append(doc)
-        return jsonify(history), 200
-    except Exception as e:
-        logging.error(f"Error retrieving notification history: {e}")
-        return jsonify({"message": "Error retrieving notification history"}), 500
+        # Clamp to 1..500: pymongo treats limit(0) as "no limit", which
+        # would stream the entire collection past the cap.
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+    except ValueError:
+        return ojsonify({"message": "Invalid limit"}, 400)
+    query = {}
+    before = request.args.get("before")
+    if before:
+        try:
+            query["timestamp"] = {"$lt": datetime.fromisoformat(before)}
+        except ValueError:
+            return ojsonify({"message": "Invalid before timestamp"}, 400)
+
+    def generate():
+        # Stream one document at a time so peak memory is O(limit) per doc,
+        # not the whole page; the sort rides the timestamp index. Clients
+        # pass the last timestamp back as ?before=<iso> for the next page.
+        # Errors must be handled in here — the response status is already
+        # sent once streaming starts, so on failure we log, emit an error
+        # sentinel, and close the array.
+        count = 0
+        yield b"["
+        try:
+            cursor = notifications_history_collection.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit)
+            for doc in cursor:
+                prefix = b", " if count else b""
+                count += 1
+                yield prefix + orjson.dumps(doc)
+        except Exception as e:
+            logging.error(f"Error streaming notification history: {e}")
+            yield (b", " if count else b"") + b'{"error": "History stream aborted"}'
+        yield b"]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=os.environ.get("PORT", 5000))
+    # Dev server only. Blocking FCM work already runs off the request thread
+    # on the job/send pools; threaded=True lets the quick DB-backed routes
+    # overlap too instead of serializing on a single worker.
+    app.run(host="0.0.0.0", port=os.environ.get("PORT", 5000), threaded=True)
 
 